@@ -5,7 +5,7 @@
  * CV token extractor, running it as a child process.
  */
 
-import { spawn } from 'child_process';
+import { spawn, type ChildProcess } from 'child_process';
 import path from 'path';
 import { fileURLToPath } from 'url';
 import { 
@@ -99,6 +99,118 @@ export interface CVWalkthroughResult {
   processingTimeMs?: number;
 }
 
+interface PendingCVRequest {
+  worker: ChildProcess;
+  resolve: (result: unknown) => void;
+  reject: (err: Error) => void;
+  timer: ReturnType<typeof setTimeout>;
+}
+
+let cvWorker: ChildProcess | null = null;
+let nextCVRequestId = 1;
+const pendingCVRequests = new Map<number, PendingCVRequest>();
+
+/**
+ * Reject every in-flight request owned by a worker that went away
+ */
+function failPendingCVRequests(worker: ChildProcess, error: Error): void {
+  pendingCVRequests.forEach((pending, id) => {
+    if (pending.worker === worker) {
+      clearTimeout(pending.timer);
+      pendingCVRequests.delete(id);
+      pending.reject(error);
+    }
+  });
+}
+
+/**
+ * Get the resident Python worker (extract_tokens.py --server), spawning it on first use.
+ * The worker keeps cv2/numpy/scipy/coloraide imported across requests.
+ */
+function getCVWorker(): ChildProcess {
+  if (cvWorker && cvWorker.exitCode === null && !cvWorker.killed) {
+    return cvWorker;
+  }
+
+  const scriptPath = path.join(__dirname, 'cv', 'extract_tokens.py');
+  const worker = spawn('python3', [scriptPath, '--server'], {
+    stdio: ['pipe', 'pipe', 'pipe'],
+  });
+
+  let buffer = '';
+  worker.stdout!.on('data', (data: Buffer) => {
+    buffer += data.toString();
+    let newline: number;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline);
+      buffer = buffer.slice(newline + 1);
+      if (!line.trim()) continue;
+
+      let message: { id?: number; result?: unknown; error?: string };
+      try {
+        message = JSON.parse(line);
+      } catch (parseError) {
+        console.error('[CV Bridge] Failed to parse worker output:', line.substring(0, 500));
+        continue;
+      }
+
+      const pending = message.id != null ? pendingCVRequests.get(message.id) : undefined;
+      if (!pending) continue;
+      pendingCVRequests.delete(message.id!);
+      clearTimeout(pending.timer);
+
+      if (message.error) {
+        pending.reject(new Error(message.error));
+      } else {
+        pending.resolve(message.result);
+      }
+    }
+  });
+
+  worker.stderr!.on('data', (data: Buffer) => {
+    console.error('[CV Bridge] Worker stderr:', data.toString());
+  });
+
+  worker.on('exit', (code) => {
+    if (cvWorker === worker) cvWorker = null;
+    failPendingCVRequests(worker, new Error(`CV worker exited with code ${code}`));
+  });
+
+  worker.on('error', (err: Error) => {
+    console.error('[CV Bridge] Worker error:', err);
+    if (cvWorker === worker) cvWorker = null;
+    failPendingCVRequests(worker, new Error(`Process error: ${err.message}`));
+  });
+
+  cvWorker = worker;
+  return worker;
+}
+
+/**
+ * Send one request to the resident worker and wait for its response.
+ * A request that times out restarts the worker, since it may be wedged.
+ */
+function runCVWorker<T>(payload: Record<string, unknown>, timeoutMs: number): Promise<T> {
+  return new Promise((resolve, reject) => {
+    const worker = getCVWorker();
+    const id = nextCVRequestId++;
+
+    const timer = setTimeout(() => {
+      pendingCVRequests.delete(id);
+      reject(new Error('CV extraction timed out'));
+      worker.kill();
+    }, timeoutMs);
+
+    pendingCVRequests.set(id, {
+      worker,
+      resolve: resolve as (result: unknown) => void,
+      reject,
+      timer,
+    });
+    worker.stdin!.write(JSON.stringify({ id, ...payload }) + '\n');
+  });
+}
+
 /**
  * Check if CV extraction is enabled via environment variable
  */
@@ -129,72 +241,28 @@ export async function extractTokensWithCV(imageBase64: string, useCache: boolean
     }
   }
   
-  return new Promise((resolve) => {
-    const scriptPath = path.join(__dirname, 'cv', 'extract_tokens.py');
-    
-    const pythonProcess = spawn('python3', [scriptPath], {
-      stdio: ['pipe', 'pipe', 'pipe'],
-      timeout: 30000,
-    });
+  try {
+    const tokens = await runCVWorker<CVExtractedTokens>({ data: imageBase64 }, 30000);
+    const processingTimeMs = Date.now() - startTime;
 
-    let stdout = '';
-    let stderr = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      stdout += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-      stderr += data.toString();
-    });
-
-    pythonProcess.on('close', async (code) => {
-      const processingTimeMs = Date.now() - startTime;
-
-      if (code !== 0) {
-        console.error('[CV Bridge] Python process failed:', stderr);
-        resolve({
-          success: false,
-          error: stderr || 'CV extraction failed',
-          processingTimeMs,
-        });
-        return;
-      }
-
-      try {
-        const tokens = JSON.parse(stdout) as CVExtractedTokens;
-        
-        if (useCache) {
-          await setCachedTokens(imageHash, tokens, processingTimeMs);
-        }
-        
-        resolve({
-          success: true,
-          tokens,
-          processingTimeMs,
-        });
-      } catch (parseError) {
-        console.error('[CV Bridge] Failed to parse output:', stdout);
-        resolve({
-          success: false,
-          error: 'Failed to parse CV extraction output',
-          processingTimeMs,
-        });
-      }
-    });
-
-    pythonProcess.on('error', (err) => {
-      console.error('[CV Bridge] Process error:', err);
-      resolve({
-        success: false,
-        error: `Process error: ${err.message}`,
-        processingTimeMs: Date.now() - startTime,
-      });
-    });
+    if (useCache) {
+      await setCachedTokens(imageHash, tokens, processingTimeMs);
+    }
 
-    pythonProcess.stdin.write(imageBase64);
-    pythonProcess.stdin.end();
-  });
+    return {
+      success: true,
+      tokens,
+      processingTimeMs,
+    };
+  } catch (err) {
+    const message = err instanceof Error ? err.message : String(err);
+    console.error('[CV Bridge] CV extraction failed:', message);
+    return {
+      success: false,
+      error: message || 'CV extraction failed',
+      processingTimeMs: Date.now() - startTime,
+    };
+  }
 }
 
 /**
@@ -16,12 +16,17 @@ Dependencies:
 - scipy
 - coloraide
 
+Optional:
+- pybase64 (SIMD base64 for uploaded images and debug visuals)
+- orjson (fast JSON output, with native NumPy support)
+
 This file intentionally avoids:
 - Deep learning
 - Heavy OCR
 - GPU dependencies
 """
 
+import os
 import sys
 import json
 import base64
@@ -30,24 +35,42 @@ import cv2
 import numpy as np
 from scipy.spatial.distance import cdist
 from coloraide import Color
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # ------------------------------------------------------------
 # Utility helpers
 # ------------------------------------------------------------
 
-def resize_for_speed(img, max_width=256):
+# Shared structuring elements; OpenCV only reads them
+_KERNEL_3X3 = np.ones((3, 3), np.uint8)
+_KERNEL_5X5 = np.ones((5, 5), np.uint8)
+
+
+def resize_for_speed(img, max_width=256, tolerance=1.05):
     """
     Downscale image to reduce computation cost.
     UI screenshots retain structure at low resolutions.
+    Images within `tolerance` of the target width are left untouched.
+    Always returns a C-contiguous array, so the extractors' OpenCV calls
+    never copy a strided view on every call.
     """
     h, w = img.shape[:2]
-    if w <= max_width:
-        return img
+    if w <= max_width * tolerance:
+        return np.ascontiguousarray(img)
     scale = max_width / w
-    return cv2.resize(img, (int(w * scale), int(h * scale)))
+    return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
 
 
 def quantize_values(values, snap_points):
@@ -55,13 +78,32 @@ def quantize_values(values, snap_points):
     Snap continuous measurements (px, radius, opacity)
     to a small discrete scale typical of design systems.
     """
-    if not values:
+    if len(values) == 0:
         return []
-    snapped = []
-    for v in values:
-        closest = min(snap_points, key=lambda x: abs(x - v))
-        snapped.append(closest)
-    return sorted(list(set(snapped)))
+    v = np.asarray(values, dtype=np.float64)
+    snaps = np.sort(np.asarray(snap_points))
+    if len(snaps) == 1:
+        return snaps.tolist()
+    # Nearest of the two neighbours bracketing each value; ties go to the
+    # smaller snap point
+    idx = np.clip(np.searchsorted(snaps, v), 1, len(snaps) - 1)
+    left = snaps[idx - 1]
+    right = snaps[idx]
+    chosen = np.where(v - left <= right - v, left, right)
+    return np.unique(chosen).tolist()
+
+
+def _precompute(img):
+    """
+    Compute intermediates several extractors need from the same image.
+    Saves each extractor its own cvtColor / Otsu pass.
+
+    Returns (gray, lab, otsu).
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)
+    return gray, lab, otsu
 
 
 def encode_image_base64(img, max_size=256):
@@ -75,13 +117,13 @@ def encode_image_base64(img, max_size=256):
     h, w = img.shape[:2] if len(img.shape) >= 2 else (0, 0)
     if w > max_size or h > max_size:
         scale = max_size / max(w, h)
-        img = cv2.resize(img, (int(w * scale), int(h * scale)))
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
     
     if len(img.shape) == 2:
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
     
     _, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 80])
-    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+    return f"data:image/jpeg;base64,{_b64.b64encode(buffer).decode('ascii')}"
 
 
 def create_color_palette_visual(colors_rgb, img_shape):
@@ -95,11 +137,15 @@ def create_color_palette_visual(colors_rgb, img_shape):
     if len(colors_rgb) == 0:
         return bar
     
-    stripe_width = width // len(colors_rgb)
-    for i, color in enumerate(colors_rgb):
-        x_start = i * stripe_width
-        x_end = (i + 1) * stripe_width if i < len(colors_rgb) - 1 else width
-        bar[:, x_start:x_end] = color
+    # Column -> stripe lookup; the last stripe absorbs the remainder
+    n = len(colors_rgb)
+    stripe_width = width // n
+    if stripe_width:
+        stripe = np.minimum(np.arange(width) // stripe_width, n - 1)
+    else:
+        stripe = np.full(width, n - 1)
+    row = np.asarray(colors_rgb, dtype=np.uint8).reshape(n, 3)[stripe]
+    bar[:] = row[None, :, :]
     
     return bar
 
@@ -109,7 +155,7 @@ def create_histogram_visual(data, title="", bins=50):
     Create a simple histogram visualization.
     """
     height, width = 100, 256
-    hist_img = np.ones((height, width, 3), dtype=np.uint8) * 40
+    hist_img = np.full((height, width, 3), 40, dtype=np.uint8)
     
     if len(data) == 0:
         return hist_img
@@ -118,29 +164,141 @@ def create_histogram_visual(data, title="", bins=50):
     if hist.max() > 0:
         hist = (hist / hist.max() * (height - 10)).astype(int)
     
+    # Fill the bars as one skyline polygon instead of a rectangle per bin;
+    # fillPoly includes the outline, so shared bar edges match the old fill
     bin_width = width // len(hist)
-    for i, h in enumerate(hist):
-        x1 = i * bin_width
-        x2 = (i + 1) * bin_width
-        y1 = height - h - 5
-        y2 = height - 5
-        cv2.rectangle(hist_img, (x1, y2), (x2, y1), (100, 180, 255), -1)
+    x = np.arange(len(hist) + 1) * bin_width
+    tops = height - 5 - hist
+    pts = np.empty((2 * len(hist) + 2, 2), np.int32)
+    pts[0] = (0, height - 5)
+    pts[-1] = (x[-1], height - 5)
+    pts[1:-1:2, 0] = x[:-1]
+    pts[2:-1:2, 0] = x[1:]
+    pts[1:-1, 1] = np.repeat(tops, 2)
+    cv2.fillPoly(hist_img, [pts], (100, 180, 255))
     
     return hist_img
 
 
-def _percentile_normalize(x):
+def _draw_bars(canvas, starts, ends, color):
+    """
+    Draw 1px bars from starts[i] to ends[i] ((x, y) pairs) with a single
+    polylines call; pixel-identical to one cv2.line per bar.
+    """
+    segments = np.stack([starts, ends], axis=1).astype(np.int32)
+    cv2.polylines(canvas, segments, False, color, 1)
+
+
+def _percentile_normalize(x, bins=1024):
     """
     Normalize array to [0,1] using 2nd/98th percentile for robustness.
+    Percentiles are read off a histogram CDF (interpolated within the bin)
+    instead of a full selection over every pixel.
     """
-    x = x.astype(np.float32)
-    mn, mx = np.percentile(x, 2), np.percentile(x, 98)
+    x = x.astype(np.float32, copy=False)
+    lo, hi, _, _ = cv2.minMaxLoc(x)
+    if hi - lo < 1e-6:
+        return np.zeros_like(x)
+    
+    # Bin on integer codes: calcHist's uint16 path is several times faster
+    # than its float one. The top value is clamped into the last bin.
+    width = (hi - lo) / bins
+    codes = np.subtract(x, np.float32(lo))
+    codes *= np.float32(1.0 / width)
+    np.minimum(codes, bins - 1, out=codes)
+    hist = cv2.calcHist([codes.astype(np.uint16)], [0], None, [bins], [0, bins]).ravel()
+    cdf = np.cumsum(hist)
+    targets = np.array([0.02, 0.98]) * cdf[-1]
+    idx = np.minimum(np.searchsorted(cdf, targets), bins - 1)
+    before = np.where(idx > 0, cdf[idx - 1], 0.0)
+    frac = (targets - before) / np.maximum(hist[idx], 1.0)
+    mn, mx = lo + (idx + frac) * width
+    
     if mx - mn < 1e-6:
         return np.zeros_like(x)
-    return np.clip((x - mn) / (mx - mn), 0, 1)
+    out = np.subtract(x, np.float32(mn))
+    out *= np.float32(1.0 / (mx - mn))
+    return np.clip(out, 0, 1, out=out)
+
+
+def _percentile_cut(x, q):
+    """
+    Order statistic c with (x > c) == (x > np.percentile(x, q)) for integer x.
+    The interpolated percentile lies between two neighbouring sorted values
+    with no integer in between, so a single-kth partition gives the same mask.
+    """
+    flat = x.ravel()
+    k = int(np.floor(q / 100 * (flat.size - 1)))
+    return np.partition(flat, k)[k]
+
+
+def _median_nonzero(dist, zeros):
+    """
+    np.median(dist[dist > 0]) for a non-negative array holding `zeros`
+    zero entries, selected in place without the boolean copy.
+    """
+    flat = dist.ravel()
+    k = flat.size - zeros
+    hi = zeros + k // 2
+    part = np.partition(flat, hi)
+    if k % 2:
+        return part[hi]
+    return (part[:hi].max() + part[hi]) / 2
+
+
+def _cue_sharpness(gray):
+    """
+    Sharpness cue: blurred absolute Laplacian, percentile-normalized.
+    """
+    lap = cv2.Laplacian(gray, cv2.CV_32F, ksize=3)
+    sharp = cv2.GaussianBlur(np.abs(lap, out=lap), (0, 0), 1.0)
+    return _percentile_normalize(sharp)
+
+
+def _cue_shadow(gray):
+    """
+    Shadow cue: dark regions adjacent to edges. Returns (shadow, edges).
+    """
+    edges = cv2.Canny(gray, 80, 160)
+    
+    # No pre-blur: the edge dilation below already tolerates pixel noise,
+    # and a strict "< thr" on uint8 is "<= ceil(thr) - 1"
+    thr = int(np.ceil(cv2.mean(gray)[0] * 0.7)) - 1
+    _, shadow = cv2.threshold(gray, thr, 1, cv2.THRESH_BINARY_INV)
+    
+    edge_dilate = cv2.dilate(edges, _KERNEL_5X5)
+    shadow = cv2.bitwise_and(shadow, shadow, mask=edge_dilate)
+    return _percentile_normalize(shadow.astype(np.float32)), edges
+
+
+@lru_cache(maxsize=8)
+def _cue_perspective(h, w):
+    """
+    Perspective prior: per-row ramp from 1 at the top row to 0 at the bottom.
+    Depends only on shape, so it is built once per size and shared read-only.
+    """
+    y = np.linspace(1.0, 0.0, h, dtype=np.float32)
+    persp = np.repeat(y[:, None], w, axis=1)
+    persp.flags.writeable = False
+    return persp
+
+
+# Depth cues get their own small pool: heuristic_depth may itself run on an
+# extractor pool worker, and waiting on that pool from inside it can
+# deadlock. Created per process, like the extractor pool.
+_DEPTH_POOL = None
+_DEPTH_POOL_PID = None
+
 
+def _get_depth_pool():
+    global _DEPTH_POOL, _DEPTH_POOL_PID
+    if _DEPTH_POOL is None or _DEPTH_POOL_PID != os.getpid():
+        _DEPTH_POOL = ThreadPoolExecutor(max_workers=2)
+        _DEPTH_POOL_PID = os.getpid()
+    return _DEPTH_POOL
 
-def heuristic_depth(image_bgr):
+
+def heuristic_depth(image_bgr, gray=None):
     """
     Estimate depth from a single image using multi-cue fusion.
     
@@ -149,37 +307,27 @@ def heuristic_depth(image_bgr):
     2. Shadow near edges - shadows suggest depth layers
     3. Perspective prior - bottom of image typically closer
     
+    The sharpness cue runs on a helper thread while the shadow and
+    perspective cues are computed here; all are GIL-releasing OpenCV work.
+    A precomputed grayscale image may be passed in to skip the conversion.
+    
     Returns:
         depth: float32 HxW in [0..1] (1 = near/foreground)
         debug_maps: dict of intermediate cue visualizations
     """
     h, w = image_bgr.shape[:2]
     
-    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
     
-    lap = cv2.Laplacian(gray, cv2.CV_32F, ksize=3)
-    sharp = cv2.GaussianBlur(np.abs(lap), (0, 0), 1.0)
-    sharp = _percentile_normalize(sharp)
+    sharp_future = _get_depth_pool().submit(_cue_sharpness, gray)
+    shadow, edges = _cue_shadow(gray)
+    persp = _cue_perspective(h, w)
+    sharp = sharp_future.result()
     
-    edges = cv2.Canny(gray, 80, 160)
-    
-    blur = cv2.GaussianBlur(gray, (7, 7), 0)
-    shadow = blur < (np.mean(blur) * 0.7)
-    shadow = shadow.astype(np.float32)
-    
-    kernel = np.ones((5, 5), np.uint8)
-    edge_dilate = cv2.dilate(edges, kernel)
-    shadow = shadow * (edge_dilate > 0)
-    shadow = _percentile_normalize(shadow)
-    
-    y = np.linspace(1.0, 0.0, h, dtype=np.float32)
-    persp = np.repeat(y[:, None], w, axis=1)
-    
-    depth = (
-        0.45 * sharp +
-        0.35 * shadow +
-        0.20 * persp
-    )
+    # Two fused multiply-adds instead of three scaled temporaries
+    depth = cv2.addWeighted(sharp, 0.45, shadow, 0.35, 0.0)
+    depth = cv2.addWeighted(depth, 1.0, persp, 0.20, 0.0, dst=depth)
     depth = _percentile_normalize(depth)
     
     debug = {
@@ -197,10 +345,100 @@ def create_depth_visualization(depth_map, colormap=cv2.COLORMAP_PLASMA):
     Convert depth map to colorized visualization.
     Plasma colormap: purple=far, yellow=near
     """
-    depth_uint8 = (depth_map * 255).astype(np.uint8)
+    depth_uint8 = cv2.convertScaleAbs(depth_map, alpha=255)
     return cv2.applyColorMap(depth_uint8, colormap)
 
 
+@lru_cache(maxsize=8)
+def _perspective_visualization(h, w):
+    """
+    Colorized perspective prior. Like the prior itself it depends only on
+    shape, so it is built once per size and shared read-only.
+    """
+    vis = create_depth_visualization(_cue_perspective(h, w), cv2.COLORMAP_COOL)
+    vis.flags.writeable = False
+    return vis
+
+
+# ------------------------------------------------------------
+# Vectorized OKLab / OKLCH conversion
+# ------------------------------------------------------------
+
+# Linear sRGB -> LMS and LMS' -> OKLab (Björn Ottosson's reference matrices)
+_OKLAB_M1 = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_OKLAB_M2 = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+
+
+def _bgr_to_oklab(bgr):
+    """
+    Convert an (N,3) array of 0-255 BGR values to OKLab in one batch.
+    Replaces per-color coloraide string parsing on the hot path.
+    """
+    rgb = np.asarray(bgr, dtype=np.float64).reshape(-1, 3)[:, ::-1] / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    lms = np.cbrt(linear @ _OKLAB_M1.T)
+    return lms @ _OKLAB_M2.T
+
+
+def _oklab_to_oklch(lab):
+    """
+    Cartesian OKLab -> polar OKLCH.
+    Hue is NaN for achromatic colors, matching coloraide's convention.
+    """
+    l = lab[:, 0]
+    c = np.hypot(lab[:, 1], lab[:, 2])
+    h = np.degrees(np.arctan2(lab[:, 2], lab[:, 1])) % 360
+    h = np.where(c < 1e-6, np.nan, h)
+    return np.stack([l, c, h], axis=1)
+
+
+def _oklch_token(l, c, h):
+    """
+    Build a DTCG-ready OKLCH token dict, mapping a missing hue to 0.
+    """
+    return {
+        "space": "oklch",
+        "l": round(float(l), 3),
+        "c": round(float(c), 3),
+        "h": 0 if h is None or np.isnan(h) else round(float(h), 1)
+    }
+
+
+@lru_cache(maxsize=4096)
+def _to_srgb(space, coords):
+    """
+    Cached coloraide conversion of (space, coords) to unclamped sRGB [0,1].
+    """
+    return tuple(Color(space, list(coords)).convert("srgb").coords())
+
+
+def _srgb(color):
+    """
+    sRGB channels of a coloraide Color, memoized on its space and coords.
+    """
+    return _to_srgb(color.space(), tuple(color.coords()))
+
+
+def _bgr255(color):
+    """
+    Clamped 8-bit BGR tuple of a coloraide Color for OpenCV drawing.
+    """
+    r, g, b = _srgb(color)
+    return (
+        max(0, min(255, int(b * 255))),
+        max(0, min(255, int(g * 255))),
+        max(0, min(255, int(r * 255)))
+    )
+
+
 # ------------------------------------------------------------
 # Color Analysis Utilities (using coloraide)
 # ------------------------------------------------------------
@@ -249,6 +487,9 @@ def analyze_color_harmony(colors):
         "tetradic": 0
     }
     
+    # At most 8 hues (28 pairs) arrive here, which is too few for numpy to
+    # beat a plain loop; just classify each pair once and only build the
+    # relationship dicts that are actually returned
     for i, h1 in enumerate(hues):
         for h2 in hues[i+1:]:
             diff = abs(h1 - h2)
@@ -256,17 +497,18 @@ def analyze_color_harmony(colors):
                 diff = 360 - diff
             
             if diff < 30:
-                relationships.append({"type": "analogous", "hues": [h1, h2], "angle": diff})
-                harmony_scores["analogous"] += 1
-            elif 150 < diff < 210:
-                relationships.append({"type": "complementary", "hues": [h1, h2], "angle": diff})
-                harmony_scores["complementary"] += 1
+                kind = "analogous"
+            elif diff > 150:
+                kind = "complementary"
             elif 110 < diff < 130:
-                relationships.append({"type": "triadic", "hues": [h1, h2], "angle": diff})
-                harmony_scores["triadic"] += 1
+                kind = "triadic"
             elif 80 < diff < 100:
-                relationships.append({"type": "tetradic", "hues": [h1, h2], "angle": diff})
-                harmony_scores["tetradic"] += 1
+                kind = "tetradic"
+            else:
+                continue
+            harmony_scores[kind] += 1
+            if len(relationships) < 5:
+                relationships.append({"type": kind, "hues": [h1, h2], "angle": diff})
     
     if hue_range < 15:
         harmony_type = "monochromatic"
@@ -303,6 +545,25 @@ def analyze_color_harmony(colors):
     }
 
 
+def _relative_luminance(colors):
+    """
+    WCAG 2.1 relative luminance of each coloraide Color, as an (n,) array.
+    """
+    rgb = np.clip(np.array([_srgb(c) for c in colors], dtype=np.float64).reshape(-1, 3), 0, 1)
+    lin = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return lin @ np.array([0.2126, 0.7152, 0.0722])
+
+
+def _contrast_matrix(colors):
+    """
+    WCAG 2.1 contrast ratios between every pair of colors, as an (n, n) array.
+    """
+    lum = _relative_luminance(colors)
+    lighter = np.maximum(lum[:, None], lum[None, :])
+    darker = np.minimum(lum[:, None], lum[None, :])
+    return (lighter + 0.05) / (darker + 0.05)
+
+
 def calculate_contrast_ratio(color1, color2):
     """
     Calculate WCAG 2.1 contrast ratio between two colors.
@@ -313,28 +574,7 @@ def calculate_contrast_ratio(color1, color2):
     Returns:
         float contrast ratio (1:1 to 21:1)
     """
-    def relative_luminance(c):
-        rgb = c.convert("srgb")
-        r, g, b = rgb['red'], rgb['green'], rgb['blue']
-        
-        def linearize(v):
-            if v <= 0.03928:
-                return v / 12.92
-            return ((v + 0.055) / 1.055) ** 2.4
-        
-        r = linearize(max(0, min(1, r)))
-        g = linearize(max(0, min(1, g)))
-        b = linearize(max(0, min(1, b)))
-        
-        return 0.2126 * r + 0.7152 * g + 0.0722 * b
-    
-    l1 = relative_luminance(color1)
-    l2 = relative_luminance(color2)
-    
-    lighter = max(l1, l2)
-    darker = min(l1, l2)
-    
-    return (lighter + 0.05) / (darker + 0.05)
+    return float(_contrast_matrix([color1, color2])[0, 1])
 
 
 def analyze_contrast_pairs(colors):
@@ -351,9 +591,11 @@ def analyze_contrast_pairs(colors):
     aaa_pass = 0
     total_pairs = 0
     
-    for i, c1 in enumerate(colors):
-        for j, c2 in enumerate(colors[i+1:], i+1):
-            ratio = calculate_contrast_ratio(c1, c2)
+    ratios = _contrast_matrix(colors).tolist()
+    
+    for i in range(len(colors)):
+        for j in range(i + 1, len(colors)):
+            ratio = ratios[i][j]
             
             aa_normal = ratio >= 4.5
             aa_large = ratio >= 3.0
@@ -465,27 +707,46 @@ def analyze_color_temperature(colors):
     }
 
 
+@lru_cache(maxsize=4)
+def _hue_wheel_base(size):
+    """
+    Background and OKLCH hue ring for the harmony wheel, built once per size.
+    """
+    img = np.full((size, size, 3), 40, dtype=np.uint8)
+    center = size // 2
+    radius = size // 2 - 20
+    
+    hue_bgr = np.empty((360, 3), dtype=np.uint8)
+    for angle in range(360):
+        hue_color = Color(f"oklch(0.7 0.15 {angle})").convert("srgb")
+        hue_bgr[angle] = [
+            max(0, min(255, int(hue_color['blue'] * 255))),
+            max(0, min(255, int(hue_color['green'] * 255))),
+            max(0, min(255, int(hue_color['red'] * 255)))
+        ]
+    
+    # Same (angle, r) visiting order as a nested loop, so overlapping
+    # pixels keep the later angle
+    angles, rs = np.meshgrid(np.arange(360), np.arange(radius - 30, radius), indexing="ij")
+    angles, rs = angles.ravel(), rs.ravel()
+    rad = np.radians(angles)
+    xs = (center + rs * np.cos(rad)).astype(np.int64)
+    ys = (center - rs * np.sin(rad)).astype(np.int64)
+    inside = (xs >= 0) & (xs < size) & (ys >= 0) & (ys < size)
+    img[ys[inside], xs[inside]] = hue_bgr[angles[inside]]
+    
+    img.flags.writeable = False
+    return img
+
+
 def create_harmony_wheel_visual(colors, size=256):
     """
     Create a color wheel visualization showing palette positions and harmony lines.
     """
-    img = np.ones((size, size, 3), dtype=np.uint8) * 40
+    img = _hue_wheel_base(size).copy()
     center = size // 2
     radius = size // 2 - 20
     
-    for angle in range(0, 360, 1):
-        rad = np.radians(angle)
-        for r in range(radius - 30, radius):
-            x = int(center + r * np.cos(rad))
-            y = int(center - r * np.sin(rad))
-            if 0 <= x < size and 0 <= y < size:
-                hue_color = Color(f"oklch(0.7 0.15 {angle})").convert("srgb")
-                img[y, x] = [
-                    max(0, min(255, int(hue_color['blue'] * 255))),
-                    max(0, min(255, int(hue_color['green'] * 255))),
-                    max(0, min(255, int(hue_color['red'] * 255)))
-                ]
-    
     color_positions = []
     for c in colors:
         if c['c'] < 0.02:
@@ -500,12 +761,7 @@ def create_harmony_wheel_visual(colors, size=256):
         y = int(center - marker_r * np.sin(rad))
         color_positions.append((x, y, hue))
         
-        rgb = c.convert("srgb")
-        color_bgr = (
-            max(0, min(255, int(rgb['blue'] * 255))),
-            max(0, min(255, int(rgb['green'] * 255))),
-            max(0, min(255, int(rgb['red'] * 255)))
-        )
+        color_bgr = _bgr255(c)
         cv2.circle(img, (x, y), 8, color_bgr, -1)
         cv2.circle(img, (x, y), 8, (255, 255, 255), 2)
     
@@ -530,19 +786,14 @@ def create_contrast_matrix_visual(colors, contrasts):
     """
     n = len(colors)
     if n < 2:
-        return np.ones((100, 100, 3), dtype=np.uint8) * 40
+        return np.full((100, 100, 3), 40, dtype=np.uint8)
     
     cell_size = min(40, 256 // n)
     size = n * cell_size
-    img = np.ones((size, size, 3), dtype=np.uint8) * 40
+    img = np.full((size, size, 3), 40, dtype=np.uint8)
     
     for i, c in enumerate(colors):
-        rgb = c.convert("srgb")
-        color_bgr = (
-            max(0, min(255, int(rgb['blue'] * 255))),
-            max(0, min(255, int(rgb['green'] * 255))),
-            max(0, min(255, int(rgb['red'] * 255)))
-        )
+        color_bgr = _bgr255(c)
         cv2.rectangle(img, (i * cell_size, 0), ((i + 1) * cell_size, cell_size // 3), color_bgr, -1)
         cv2.rectangle(img, (0, i * cell_size), (cell_size // 3, (i + 1) * cell_size), color_bgr, -1)
     
@@ -572,13 +823,107 @@ def create_contrast_matrix_visual(colors, contrasts):
 # Color Tokens
 # ------------------------------------------------------------
 
+def _color_histogram(pixels):
+    """
+    Collapse uint8 BGR pixels into a 32x32x32 (5-bit) color cube.
+    Returns the mean color of every occupied bin and its pixel count.
+    """
+    q = pixels.astype(np.int32) >> 3
+    packed = (q[:, 0] << 10) | (q[:, 1] << 5) | q[:, 2]
+    counts = np.bincount(packed, minlength=32768)
+    occupied = np.flatnonzero(counts)
+    sums = np.stack([
+        np.bincount(packed, weights=pixels[:, ch], minlength=32768)[occupied]
+        for ch in range(3)
+    ], axis=1)
+    weights = counts[occupied].astype(np.float64)
+    return sums / weights[:, None], weights
+
+
+def _weighted_choice(rng, p):
+    """
+    Draw one index with probabilities p (summing to 1). Same draw and RNG
+    consumption as rng.choice(len(p), p=p), minus its per-call validation.
+    """
+    cdf = np.cumsum(p)
+    cdf /= cdf[-1]
+    return int(np.searchsorted(cdf, rng.random(), side="right"))
+
+
+def _weighted_kmeans(points, weights, k, max_iter=20, eps=0.5, attempts=5, seed=0):
+    """
+    Lloyd's k-means over weighted points (e.g. histogram bins).
+    Each attempt is seeded with weighted k-means++ from a fixed RNG so
+    results are deterministic; the most compact clustering wins.
+
+    Returns (labels, centers) with labels indexing into centers.
+    """
+    k = min(k, len(points))
+    rng = np.random.default_rng(seed)
+    best = None
+    weighted_points = weights[:, None] * points
+
+    for _ in range(attempts):
+        first = _weighted_choice(rng, weights / weights.sum())
+        centers = [points[first]]
+        d2 = ((points - points[first]) ** 2).sum(axis=1)
+        for _ in range(1, k):
+            prob = weights * d2
+            if prob.sum() <= 0:
+                break
+            idx = _weighted_choice(rng, prob / prob.sum())
+            centers.append(points[idx])
+            d2 = np.minimum(d2, ((points - points[idx]) ** 2).sum(axis=1))
+        centers = np.array(centers)
+
+        for _ in range(max_iter):
+            # (k, N) layout: argmin down the short axis is the slow case
+            labels = cdist(centers, points, "sqeuclidean").argmin(axis=0)
+            mass = np.bincount(labels, weights=weights, minlength=len(centers))
+            updated = np.stack([
+                np.bincount(labels, weights=weighted_points[:, ch], minlength=len(centers))
+                for ch in range(3)
+            ], axis=1)
+            filled = mass > 0
+            updated[filled] /= mass[filled, None]
+            updated[~filled] = centers[~filled]
+            shift = np.abs(updated - centers).max()
+            centers = updated
+            if shift < eps:
+                break
+
+        d2 = cdist(centers, points, "sqeuclidean")
+        labels = d2.argmin(axis=0)
+        compactness = float((weights * d2[labels, np.arange(len(points))]).sum())
+        if best is None or compactness < best[0]:
+            best = (compactness, labels, centers)
+
+    return best[1], best[2]
+
+
+def _dedupe_oklab(oklab, delta_threshold=0.03):
+    """
+    Greedy perceptual dedup over colors ordered by priority.
+    Keeps each color whose Delta-E OK (Euclidean distance in OKLab) to every
+    already-kept color is at least `delta_threshold`; 0.03 tracks the
+    former coloraide Delta-E 76 < 4. Returns the kept indices.
+    """
+    dist = cdist(oklab, oklab)
+    kept = []
+    for i in range(len(oklab)):
+        if not kept or dist[i, kept].min() >= delta_threshold:
+            kept.append(i)
+    return kept
+
+
 def extract_colors(img, k=12):
     """
     Extract dominant perceptual colors with harmony, contrast, and temperature analysis.
 
     Strategy:
     - Downscale for speed
-    - K-means clustering in RGB with weighted importance
+    - Collapse pixels into a 5-bit color histogram (distinct colors only)
+    - Weighted K-means over histogram bins, weighted by pixel coverage
     - Convert to OKLCH for perceptual accuracy
     - Deduplicate by Delta-E distance
     - Balance palette across luminance ranges
@@ -587,45 +932,25 @@ def extract_colors(img, k=12):
     - Determine color temperature
     """
     img_small = resize_for_speed(img)
-    pixels = img_small.reshape(-1, 3).astype(np.float32)
-
-    _, labels, centers = cv2.kmeans(
-        pixels,
-        k,
-        None,
-        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5),
-        5,
-        cv2.KMEANS_PP_CENTERS
-    )
+    pixels = img_small.reshape(-1, 3)
+
+    points, point_weights = _color_histogram(pixels)
+    labels, centers = _weighted_kmeans(points, point_weights, k)
+
+    counts = np.bincount(labels, weights=point_weights, minlength=len(centers))
+    weights = counts / np.sum(counts)
+    order = np.argsort(-weights, kind="stable")
+
+    oklab = _bgr_to_oklab(centers[order].astype(np.int32))
+    oklch = _oklab_to_oklch(oklab)
+
+    cluster_data = [
+        {'idx': i, 'weight': weights[order[i]], 'luminance': oklch[i, 0]}
+        for i in range(len(order))
+    ]
+
+    unique = [cluster_data[i] for i in _dedupe_oklab(oklab)]
 
-    counts = np.bincount(labels.flatten())
-    total_pixels = np.sum(counts)
-    
-    cluster_data = []
-    for idx in range(len(centers)):
-        c = centers[idx]
-        weight = counts[idx] / total_pixels
-        col = Color(f"rgb({int(c[2])},{int(c[1])},{int(c[0])})").convert("oklch")
-        cluster_data.append({
-            'color': col,
-            'weight': weight,
-            'luminance': col['l']
-        })
-    
-    cluster_data.sort(key=lambda x: -x['weight'])
-    
-    unique = []
-    delta_threshold = 4
-    for cd in cluster_data:
-        c = cd['color']
-        is_unique = True
-        for existing in unique:
-            if c.delta_e(existing['color']) < delta_threshold:
-                is_unique = False
-                break
-        if is_unique:
-            unique.append(cd)
-    
     dark = [c for c in unique if c['luminance'] < 0.35]
     mid = [c for c in unique if 0.35 <= c['luminance'] < 0.7]
     light = [c for c in unique if c['luminance'] >= 0.7]
@@ -652,23 +977,14 @@ def extract_colors(img, k=12):
                 break
     
     balanced.sort(key=lambda x: -x['weight'])
-    unique_8 = [c['color'] for c in balanced[:min(8, len(balanced))]]
-    
+    palette = oklch[[c['idx'] for c in balanced[:min(8, len(balanced))]]]
+    unique_8 = [Color("oklch", list(lch)) for lch in palette]
+
     harmony = analyze_color_harmony(unique_8)
     contrasts = analyze_contrast_pairs(unique_8)
     temperature = analyze_color_temperature(unique_8)
 
-    result = []
-    for c in unique_8:
-        hue = c['h']
-        if hue is None or (isinstance(hue, float) and np.isnan(hue)):
-            hue = 0
-        result.append({
-            "space": "oklch",
-            "l": round(c['l'], 3),
-            "c": round(c['c'], 3),
-            "h": round(hue, 1)
-        })
+    result = [_oklch_token(*lch) for lch in palette]
     return {
         "colors": result,
         "analysis": {
@@ -683,31 +999,38 @@ def extract_colors(img, k=12):
 # Spacing Tokens
 # ------------------------------------------------------------
 
-def extract_spacing(img):
+def extract_spacing(img, gray=None, otsu=None):
     """
     Infer spacing scale from bounding box deltas.
 
     Strategy:
-    - Threshold + connected components
+    - Threshold + outer contours (one per connected component)
     - Compute distances between box edges
     - Cluster into common spacing values
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)
-
-    num, _, stats, _ = cv2.connectedComponentsWithStats(bw)
-    boxes = stats[1:, :4]
-
-    deltas = []
-    for i in range(len(boxes)):
-        for j in range(i + 1, len(boxes)):
-            a, b = boxes[i], boxes[j]
-            dx = abs(a[0] - b[0])
-            dy = abs(a[1] - b[1])
-            if 2 < dx < 200:
-                deltas.append(dx)
-            if 2 < dy < 200:
-                deltas.append(dy)
+    if otsu is None:
+        if gray is None:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)
+    bw = otsu
+
+    # Outer boundaries from a two-level hierarchy are exactly the connected
+    # components, without allocating a full-image label map. Each contour
+    # starts at its component's top-left pixel, so sorting on that point
+    # visits components in raster order.
+    contours, hierarchy = cv2.findContours(bw, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return []
+    outer = np.flatnonzero(hierarchy[0][:, 3] < 0)
+    starts = np.array([contours[n][0, 0] for n in outer]).reshape(-1, 2)
+    # Only the first 100 deltas are used; 200 boxes already yield far more
+    order = outer[np.lexsort((starts[:, 0], starts[:, 1]))[:200]]
+    boxes = np.array([cv2.boundingRect(contours[n])[:2] for n in order], dtype=np.int32).reshape(-1, 2)
+
+    i, j = np.triu_indices(len(boxes), k=1)
+    # Interleave (dx, dy) per pair to keep the original pair ordering
+    pair_deltas = np.abs(boxes[i] - boxes[j]).ravel()
+    deltas = pair_deltas[(pair_deltas > 2) & (pair_deltas < 200)]
 
     snap = [4, 8, 12, 16, 24, 32, 48, 64]
     return quantize_values(deltas[:100], snap)
@@ -717,7 +1040,7 @@ def extract_spacing(img):
 # Border Radius Tokens
 # ------------------------------------------------------------
 
-def extract_border_radius(img):
+def extract_border_radius(img, gray=None):
     """
     Estimate border radius from contour curvature.
 
@@ -726,8 +1049,15 @@ def extract_border_radius(img):
     - Approximate polygon
     - Measure curvature at corners
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 80, 160)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # Median-scaled Canny thresholds, floored at the fixed 80/160 so dark
+    # UIs (median near 0) do not flood the contour scan with noise
+    med = float(np.median(gray))
+    lo = max(80, int(0.66 * med))
+    hi = max(160, min(255, int(1.33 * med)))
+    edges = cv2.Canny(gray, lo, hi)
 
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -736,21 +1066,23 @@ def extract_border_radius(img):
         if cv2.contourArea(cnt) < 200:
             continue
 
-        approx = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True)
+        peri = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
         if len(approx) >= 4:
-            peri = cv2.arcLength(cnt, True)
             radius = peri / (2 * np.pi)
             radii.append(radius)
+            if len(radii) >= 50:
+                break
 
     snap = [0, 4, 6, 8, 12, 16, 24, 32]
-    return quantize_values(radii[:50], snap)
+    return quantize_values(radii, snap)
 
 
 # ------------------------------------------------------------
 # Grid Tokens
 # ------------------------------------------------------------
 
-def extract_grid(img):
+def extract_grid(img, gray=None):
     """
     Detect grid structure via projection histograms.
 
@@ -758,12 +1090,16 @@ def extract_grid(img):
     - Sum pixels vertically/horizontally
     - Peaks = rows / columns
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    proj_x = gray.mean(axis=0)
-    proj_y = gray.mean(axis=1)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Exact integer sums via cv2.reduce, then the same float64 means as
+    # gray.mean(axis) at a fraction of the cost
+    h, w = gray.shape[:2]
+    proj_x = cv2.reduce(gray, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() / h
+    proj_y = cv2.reduce(gray, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() / w
 
-    cols = np.sum(np.abs(np.diff(proj_x)) > 20)
-    rows = np.sum(np.abs(np.diff(proj_y)) > 20)
+    cols = np.count_nonzero(np.abs(np.diff(proj_x)) > 20)
+    rows = np.count_nonzero(np.abs(np.diff(proj_y)) > 20)
 
     return {
         "columns": max(1, int(cols)),
@@ -775,7 +1111,21 @@ def extract_grid(img):
 # Shadow / Elevation Tokens
 # ------------------------------------------------------------
 
-def extract_shadows(img):
+# Shadow directions in 45° sectors, clockwise from "right" (image y points down)
+_SHADOW_DIRECTIONS = (
+    "right", "bottom-right", "bottom", "bottom-left",
+    "left", "top-left", "top", "top-right",
+)
+
+
+def _shadow_direction(angle):
+    """
+    Bucket a gradient angle in degrees (-180, 180] into a compass direction.
+    """
+    return _SHADOW_DIRECTIONS[int(np.floor((angle + 22.5) / 45.0)) % 8]
+
+
+def extract_shadows(img, lab=None):
     """
     Enhanced shadow and depth detection.
 
@@ -786,13 +1136,15 @@ def extract_shadows(img):
     - Analyze contrast distribution for depth layers
     - Extract shadow color from dark regions
     """
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    l_channel = lab[:, :, 0].astype(np.float32)
+    if lab is None:
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    l8 = lab[:, :, 0]
     
-    grad_x = cv2.Sobel(l_channel, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(l_channel, cv2.CV_32F, 0, 1, ksize=3)
+    # 3x3 Sobel/Laplacian responses on 8-bit input stay within ±1020, so
+    # int16 holds them exactly at half the footprint of float32
+    grad_x, grad_y = cv2.spatialGradient(l8)
     
-    laplacian = cv2.Laplacian(l_channel, cv2.CV_32F)
+    laplacian = cv2.Laplacian(l8, cv2.CV_16S)
     strength = np.mean(np.abs(laplacian))
     
     if strength < 2:
@@ -804,53 +1156,45 @@ def extract_shadows(img):
     else:
         level = 3
     
-    magnitude = np.sqrt(grad_x**2 + grad_y**2)
-    threshold = np.percentile(magnitude, 90)
-    strong_grads = magnitude > threshold
+    # Squared magnitude ranks pixels exactly like the magnitude itself, and
+    # the 90th-percentile cut falls between the same two neighbours
+    magnitude_sq = np.square(grad_x, dtype=np.int32)
+    magnitude_sq += np.square(grad_y, dtype=np.int32)
+    strong_grads = magnitude_sq > _percentile_cut(magnitude_sq, 90)
     
     if np.sum(strong_grads) > 0:
         avg_grad_x = np.mean(grad_x[strong_grads])
         avg_grad_y = np.mean(grad_y[strong_grads])
         angle = np.degrees(np.arctan2(avg_grad_y, avg_grad_x))
         
-        if -22.5 <= angle < 22.5:
-            direction = "right"
-        elif 22.5 <= angle < 67.5:
-            direction = "bottom-right"
-        elif 67.5 <= angle < 112.5:
-            direction = "bottom"
-        elif 112.5 <= angle < 157.5:
-            direction = "bottom-left"
-        elif angle >= 157.5 or angle < -157.5:
-            direction = "left"
-        elif -157.5 <= angle < -112.5:
-            direction = "top-left"
-        elif -112.5 <= angle < -67.5:
-            direction = "top"
-        else:
-            direction = "top-right"
+        direction = _shadow_direction(angle)
     else:
         direction = "ambient"
         angle = 0
     
-    edges = cv2.Canny(l_channel.astype(np.uint8), 50, 150)
+    edges = cv2.Canny(l8, 50, 150)
     dist_transform = cv2.distanceTransform(255 - edges, cv2.DIST_L2, 5)
-    blur_samples = dist_transform[dist_transform > 0]
-    if len(blur_samples) > 0:
-        blur_radius = round(float(np.median(blur_samples)), 1)
+    # Distances are zero exactly on the edge pixels
+    n_edges = cv2.countNonZero(edges)
+    if n_edges < edges.size:
+        blur_radius = round(float(_median_nonzero(dist_transform, n_edges)), 1)
     else:
         blur_radius = 0
     
     blur_radius = min(blur_radius, 24)
     
-    hist = cv2.calcHist([l_channel.astype(np.uint8)], [0], None, [256], [0, 256])
-    hist = hist.flatten() / hist.sum()
+    # One 256-bin histogram of L serves the tonal ratios, the contrast and
+    # the dark-pixel count without further full-image passes
+    counts = cv2.calcHist([l8], [0], None, [256], [0, 256]).ravel()
+    hist = counts / counts.sum()
     
     dark_ratio = np.sum(hist[:85])
     mid_ratio = np.sum(hist[85:170])
     light_ratio = np.sum(hist[170:])
     
-    contrast = np.std(l_channel)
+    levels = np.arange(256)
+    mean_l = np.dot(levels, hist)
+    contrast = np.sqrt(np.dot((levels - mean_l) ** 2, hist))
     
     if dark_ratio > 0.4 and light_ratio > 0.2:
         depth_style = "high-contrast"
@@ -863,20 +1207,11 @@ def extract_shadows(img):
     else:
         depth_style = "balanced"
     
-    dark_mask = l_channel < 50
-    if np.sum(dark_mask) > 100:
-        dark_pixels = img[dark_mask]
-        if len(dark_pixels) > 0:
-            avg_dark = np.mean(dark_pixels, axis=0)
-            shadow_color = Color(f"rgb({int(avg_dark[2])},{int(avg_dark[1])},{int(avg_dark[0])})").convert("oklch")
-            shadow_color_data = {
-                "space": "oklch",
-                "l": round(shadow_color['l'], 3),
-                "c": round(shadow_color['c'], 3),
-                "h": round(shadow_color['h'] if shadow_color['h'] and not np.isnan(shadow_color['h']) else 0, 1)
-            }
-        else:
-            shadow_color_data = None
+    if counts[:50].sum() > 100:
+        dark_mask = (l8 < 50).view(np.uint8)
+        avg_dark = np.array(cv2.mean(img, mask=dark_mask)[:3])
+        shadow_lch = _oklab_to_oklch(_bgr_to_oklab(avg_dark.astype(np.int32)))[0]
+        shadow_color_data = _oklch_token(*shadow_lch)
     else:
         shadow_color_data = None
 
@@ -901,7 +1236,34 @@ def extract_shadows(img):
 # Stroke Tokens
 # ------------------------------------------------------------
 
-def extract_strokes(img):
+def _ridge_mask(dist):
+    """
+    Local maxima of a distance transform: the medial ridge of each stroke.
+    """
+    return (dist >= cv2.dilate(dist, _KERNEL_3X3)) & (dist > 0.5)
+
+
+def _sample_widths(widths, n=200):
+    """
+    Evenly subsample up to n half-widths across the image and double them.
+    """
+    step = max(1, widths.size // n)
+    return widths[::step][:n] * 2
+
+
+def _edge_widths(gray, edges=None):
+    """
+    Fallback half-widths from dilated Canny edges, for images with no
+    foreground ridge. Kept off the common path.
+    """
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150)
+    dilated = cv2.dilate(edges, _KERNEL_3X3, iterations=2)
+    dist_from_edges = cv2.distanceTransform(dilated, cv2.DIST_L2, 5)
+    return dist_from_edges[dist_from_edges > 0]
+
+
+def extract_strokes(img, gray=None, otsu=None):
     """
     Estimate stroke widths from edges using skeleton-based analysis.
 
@@ -911,30 +1273,26 @@ def extract_strokes(img):
     - Sample at skeleton/ridge points to get stroke half-widths
     - Double to get full stroke width
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)
-    
-    binary_inv = 255 - binary
+    # A shared Otsu mask only needs inverting; otherwise threshold straight
+    # to the inverted mask in one pass
+    if otsu is None:
+        _, binary_inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    else:
+        binary_inv = 255 - otsu
     
     dist = cv2.distanceTransform(binary_inv, cv2.DIST_L2, 5)
+    # Ridge points are already > 0.5, so any hit is a usable width
+    widths = dist[_ridge_mask(dist)]
+    if widths.size == 0:
+        widths = _edge_widths(gray)
     
-    kernel = np.ones((3, 3), np.uint8)
-    eroded = cv2.erode(binary_inv, kernel, iterations=1)
-    skeleton = cv2.subtract(binary_inv, eroded)
-    
-    widths = dist[skeleton > 0]
-    
-    if len(widths) == 0 or np.max(widths) < 0.5:
-        edges = cv2.Canny(gray, 50, 150)
-        dilated = cv2.dilate(edges, kernel, iterations=2)
-        dist_from_edges = cv2.distanceTransform(dilated, cv2.DIST_L2, 5)
-        widths = dist_from_edges[dist_from_edges > 0]
-    
-    if len(widths) == 0:
+    if widths.size == 0:
         return [1]
     
-    full_widths = [w * 2 for w in widths.tolist()[:200]]
+    full_widths = _sample_widths(widths)
     
     snap = [1, 2, 3, 4, 6, 8]
     return quantize_values(full_widths, snap)
@@ -944,24 +1302,26 @@ def extract_strokes(img):
 # Parallel extraction wrappers
 # ------------------------------------------------------------
 
-def _run_extractor(extractor_name, img_bytes, img_shape):
+# The heavy extractor work (cvtColor, Canny, Sobel, distanceTransform,
+# findContours, NumPy/BLAS) releases the GIL, so a thread pool runs the
+# extractors concurrently on one shared image with no fork/pickle cost.
+# OpenCV's own worker threads are disabled to avoid oversubscribing the
+# cores underneath the pool.
+cv2.setNumThreads(1)
+_THREAD_POOL = None
+_THREAD_POOL_PID = None
+
+
+def _get_thread_pool():
     """
-    Worker function for parallel extraction.
-    Reconstructs image from bytes and runs the specified extractor.
+    Return the extractor thread pool, creating it on first use in this
+    process. A forked child never inherits the parent's (dead) threads.
     """
-    img = np.frombuffer(img_bytes, dtype=np.uint8).reshape(img_shape)
-    
-    extractors = {
-        "color": extract_colors,
-        "spacing": extract_spacing,
-        "borderRadius": extract_border_radius,
-        "grid": extract_grid,
-        "elevation": extract_shadows,
-        "strokeWidth": extract_strokes,
-    }
-    
-    extractor_fn = extractors[extractor_name]
-    return extractor_name, extractor_fn(img)
+    global _THREAD_POOL, _THREAD_POOL_PID
+    if _THREAD_POOL is None or _THREAD_POOL_PID != os.getpid():
+        _THREAD_POOL = ThreadPoolExecutor(max_workers=min(6, os.cpu_count() or 1))
+        _THREAD_POOL_PID = os.getpid()
+    return _THREAD_POOL
 
 
 # ------------------------------------------------------------
@@ -973,17 +1333,18 @@ def extract_design_tokens_sequential(img):
     Sequential extraction pass (fallback).
     """
     img_resized = resize_for_speed(img, 512)
+    gray, lab, otsu = _precompute(img_resized)
     
     color_result = extract_colors(img_resized)
 
     return {
         "color": color_result["colors"],
         "colorAnalysis": color_result["analysis"],
-        "spacing": extract_spacing(img_resized),
-        "borderRadius": extract_border_radius(img_resized),
-        "grid": extract_grid(img_resized),
-        "elevation": extract_shadows(img_resized),
-        "strokeWidth": extract_strokes(img_resized),
+        "spacing": extract_spacing(img_resized, gray=gray, otsu=otsu),
+        "borderRadius": extract_border_radius(img_resized, gray=gray),
+        "grid": extract_grid(img_resized, gray=gray),
+        "elevation": extract_shadows(img_resized, lab=lab),
+        "strokeWidth": extract_strokes(img_resized, gray=gray, otsu=otsu),
         "meta": {
             "method": "heuristic-cv",
             "confidence": "medium-high",
@@ -995,31 +1356,37 @@ def extract_design_tokens_sequential(img):
 
 def extract_design_tokens_parallel(img):
     """
-    Parallel extraction using multiprocessing.
-    Runs all extractors concurrently for faster execution.
+    Parallel extraction using the shared thread pool.
+    Runs all extractors concurrently on the same in-memory image.
     """
     img_resized = resize_for_speed(img, 512)
-    
-    img_bytes = img_resized.tobytes()
-    img_shape = img_resized.shape
-    
-    extractor_names = ["color", "spacing", "borderRadius", "grid", "elevation", "strokeWidth"]
+    executor = _get_thread_pool()
+    
+    # Colour extraction needs none of the shared intermediates, so start it
+    # before building them; everything else shares one gray/lab/Otsu set
+    futures = {executor.submit(extract_colors, img_resized): "color"}
+    gray, lab, otsu = _precompute(img_resized)
+    
+    jobs = {
+        "spacing": partial(extract_spacing, img_resized, gray=gray, otsu=otsu),
+        "borderRadius": partial(extract_border_radius, img_resized, gray=gray),
+        "grid": partial(extract_grid, img_resized, gray=gray),
+        "elevation": partial(extract_shadows, img_resized, lab=lab),
+        "strokeWidth": partial(extract_strokes, img_resized, gray=gray, otsu=otsu),
+    }
     
     results = {}
     
-    with ProcessPoolExecutor(max_workers=len(extractor_names)) as executor:
-        futures = {
-            executor.submit(_run_extractor, name, img_bytes, img_shape): name
-            for name in extractor_names
-        }
-        
-        for future in as_completed(futures):
-            name, result = future.result()
-            if name == "color":
-                results["color"] = result["colors"]
-                results["colorAnalysis"] = result["analysis"]
-            else:
-                results[name] = result
+    futures.update({executor.submit(fn): name for name, fn in jobs.items()})
+    
+    for future in as_completed(futures):
+        name = futures[future]
+        result = future.result()
+        if name == "color":
+            results["color"] = result["colors"]
+            results["colorAnalysis"] = result["analysis"]
+        else:
+            results[name] = result
     
     results["meta"] = {
         "method": "heuristic-cv",
@@ -1053,48 +1420,33 @@ def extract_colors_with_debug(img, k=12):
     Uses improved weighted balancing algorithm for better palette accuracy.
     """
     img_small = resize_for_speed(img)
-    pixels = img_small.reshape(-1, 3).astype(np.float32)
+    pixels = img_small.reshape(-1, 3)
 
-    _, labels, centers = cv2.kmeans(
-        pixels, k, None,
-        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5),
-        5, cv2.KMEANS_PP_CENTERS
-    )
+    # Same histogram-weighted k-means as extract_colors; pixels are then
+    # assigned to their nearest center for the cluster map
+    points, point_weights = _color_histogram(pixels)
+    _, centers = _weighted_kmeans(points, point_weights, k)
+    labels = cdist(pixels, centers, "sqeuclidean").argmin(axis=1)
 
-    counts = np.bincount(labels.flatten())
+    counts = np.bincount(labels, minlength=len(centers))
     total_pixels = np.sum(counts)
-    ranked = centers[np.argsort(-counts)]
-    
-    cluster_map = labels.reshape(img_small.shape[:2])
-    cluster_vis = np.zeros_like(img_small)
-    for i in range(k):
-        cluster_vis[cluster_map == i] = ranked[min(i, len(ranked)-1)]
-    
-    cluster_data = []
-    for idx in range(len(centers)):
-        c = centers[idx]
-        weight = counts[idx] / total_pixels
-        col = Color(f"rgb({int(c[2])},{int(c[1])},{int(c[0])})").convert("oklch")
-        cluster_data.append({
-            'color': col,
-            'weight': weight,
-            'luminance': col['l'],
-            'rgb': (int(c[2]), int(c[1]), int(c[0]))
-        })
-    
-    cluster_data.sort(key=lambda x: -x['weight'])
-    
-    unique = []
-    delta_threshold = 4
-    for cd in cluster_data:
-        c = cd['color']
-        is_unique = True
-        for existing in unique:
-            if c.delta_e(existing['color']) < delta_threshold:
-                is_unique = False
-                break
-        if is_unique:
-            unique.append(cd)
+    
+    # One gather paints every pixel with its own cluster center
+    cluster_vis = centers.astype(np.uint8)[labels].reshape(img_small.shape)
+    
+    # Convert all centers in one batch and dedupe in OKLab, as extract_colors
+    # does; only the final palette becomes coloraide Color objects
+    order = np.argsort(-counts, kind="stable")
+    bgr = centers[order].astype(np.int32)
+    oklab = _bgr_to_oklab(bgr)
+    oklch = _oklab_to_oklch(oklab)
+    
+    cluster_data = [
+        {'idx': i, 'weight': counts[order[i]] / total_pixels, 'luminance': oklch[i, 0]}
+        for i in range(len(order))
+    ]
+    
+    unique = [cluster_data[i] for i in _dedupe_oklab(oklab)]
     
     dark = [c for c in unique if c['luminance'] < 0.35]
     mid = [c for c in unique if 0.35 <= c['luminance'] < 0.7]
@@ -1122,11 +1474,12 @@ def extract_colors_with_debug(img, k=12):
                 break
     
     balanced.sort(key=lambda x: -x['weight'])
-    palette_colors = balanced[:min(8, len(balanced))]
-    unique_8 = [c['color'] for c in palette_colors]
+    palette_idx = [c['idx'] for c in balanced[:min(8, len(balanced))]]
+    palette = oklch[palette_idx]
+    unique_8 = [Color("oklch", list(lch)) for lch in palette]
     
     palette_bar = create_color_palette_visual(
-        [(c['rgb'][2], c['rgb'][1], c['rgb'][0]) for c in palette_colors],  
+        [tuple(int(v) for v in bgr[i]) for i in palette_idx],
         img_small.shape
     )
     
@@ -1137,17 +1490,7 @@ def extract_colors_with_debug(img, k=12):
     harmony_wheel = create_harmony_wheel_visual(unique_8)
     contrast_matrix = create_contrast_matrix_visual(unique_8, contrasts)
 
-    result = []
-    for c in unique_8:
-        hue = c['h']
-        if hue is None or (isinstance(hue, float) and np.isnan(hue)):
-            hue = 0
-        result.append({
-            "space": "oklch",
-            "l": round(c['l'], 3),
-            "c": round(c['c'], 3),
-            "h": round(hue, 1)
-        })
+    result = [_oklch_token(*lch) for lch in palette]
     
     return {
         "tokens": result,
@@ -1168,7 +1511,7 @@ def extract_colors_with_debug(img, k=12):
                 "K-means clustering (20 iterations) groups similar pixels into color families",
                 "We count how often each color appears and weight by pixel coverage",
                 "Colors are converted to OKLCH (a perceptual color space)",
-                "Very similar colors (Delta-E < 4) are merged to avoid duplicates",
+                "Very similar colors (OKLab Delta-E < 0.03) are merged to avoid duplicates",
                 "Colors are balanced across luminance ranges (dark/mid/light) for variety",
                 "The top 8 balanced colors become your palette",
                 f"HARMONY: Hue angles are analyzed - detected '{harmony['type']}' with {harmony['strength']*100:.0f}% strength",
@@ -1179,12 +1522,15 @@ def extract_colors_with_debug(img, k=12):
     }
 
 
-def extract_spacing_with_debug(img):
+def extract_spacing_with_debug(img, gray=None, edges=None, edges_image=None):
     """
     Extract spacing with intermediate visualizations.
+    edges_image is an already-encoded copy of edges, if the caller has one.
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150)
     
     _, thresh = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY)
     contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -1196,16 +1542,13 @@ def extract_spacing_with_debug(img):
     for x, y, w, h in boxes:
         cv2.rectangle(bbox_vis, (x, y), (x + w, y + h), (0, 255, 0), 1)
     
-    boxes.sort(key=lambda b: (b[1], b[0]))
-    for i in range(len(boxes) - 1):
-        x1, y1, w1, h1 = boxes[i]
-        x2, y2, w2, h2 = boxes[i + 1]
-        hgap = max(0, x2 - (x1 + w1))
-        vgap = max(0, y2 - (y1 + h1))
-        if 2 < hgap < 100:
-            gaps.append(hgap)
-        if 2 < vgap < 100:
-            gaps.append(vgap)
+    if len(boxes) > 1:
+        b = np.array(boxes, dtype=np.int32)
+        b = b[np.lexsort((b[:, 0], b[:, 1]))]
+        # Gap from each box's far edge to the next box's near edge, with
+        # (hgap, vgap) interleaved per neighbouring pair
+        pair_gaps = np.maximum(0, b[1:, :2] - (b[:-1, :2] + b[:-1, 2:])).ravel()
+        gaps = pair_gaps[(pair_gaps > 2) & (pair_gaps < 100)].tolist()
     
     gap_hist = create_histogram_visual(gaps, "Spacing Distribution")
     
@@ -1216,7 +1559,7 @@ def extract_spacing_with_debug(img):
         "tokens": result,
         "debug": {
             "visuals": [
-                {"label": "Edge Detection", "description": "Edges found using Canny algorithm", "image": encode_image_base64(edges)},
+                {"label": "Edge Detection", "description": "Edges found using Canny algorithm", "image": edges_image or encode_image_base64(edges)},
                 {"label": "Bounding Boxes", "description": "Detected elements with their boundaries", "image": encode_image_base64(bbox_vis)},
                 {"label": "Spacing Histogram", "description": "Distribution of gaps between elements", "image": encode_image_base64(gap_hist)},
             ],
@@ -1232,12 +1575,15 @@ def extract_spacing_with_debug(img):
     }
 
 
-def extract_border_radius_with_debug(img):
+def extract_border_radius_with_debug(img, gray=None, edges=None, edges_image=None):
     """
     Extract border radius with intermediate visualizations.
+    edges_image is an already-encoded copy of edges, if the caller has one.
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150)
     
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
@@ -1253,23 +1599,20 @@ def extract_border_radius_with_debug(img):
         epsilon = 0.02 * cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, epsilon, True)
         
-        for i in range(len(approx)):
-            p1 = approx[i - 1][0]
-            p2 = approx[i][0]
-            p3 = approx[(i + 1) % len(approx)][0]
-            
-            cv2.circle(corner_vis, tuple(p2), 3, (255, 0, 0), -1)
-            
-            v1 = np.array(p1) - np.array(p2)
-            v2 = np.array(p3) - np.array(p2)
-            
-            dot = np.dot(v1, v2)
-            mag = np.linalg.norm(v1) * np.linalg.norm(v2)
-            if mag > 0:
-                angle = np.arccos(np.clip(dot / mag, -1, 1))
-                if 1.2 < angle < 2.0:
-                    r = min(np.linalg.norm(v1), np.linalg.norm(v2)) * 0.3
-                    radii.append(r)
+        pts = approx.reshape(-1, 2)
+        for p in pts:
+            cv2.circle(corner_vis, (int(p[0]), int(p[1])), 3, (255, 0, 0), -1)
+        
+        # Corner angle at every vertex at once, against its two neighbours
+        v1 = np.roll(pts, 1, axis=0) - pts
+        v2 = np.roll(pts, -1, axis=0) - pts
+        n1 = np.sqrt((v1 * v1).sum(axis=1))
+        n2 = np.sqrt((v2 * v2).sum(axis=1))
+        mag = n1 * n2
+        valid = mag > 0
+        angle = np.arccos(np.clip((v1 * v2).sum(axis=1)[valid] / mag[valid], -1, 1))
+        corner = (angle > 1.2) & (angle < 2.0)
+        radii.extend((np.minimum(n1, n2)[valid][corner] * 0.3).tolist())
     
     snap = [0, 2, 4, 8, 12, 16, 24, 32]
     result = quantize_values(radii[:50], snap) if radii else [0, 4, 8]
@@ -1278,7 +1621,7 @@ def extract_border_radius_with_debug(img):
         "tokens": result,
         "debug": {
             "visuals": [
-                {"label": "Canny Edges", "description": "Edge detection highlights shape boundaries", "image": encode_image_base64(edges)},
+                {"label": "Canny Edges", "description": "Edge detection highlights shape boundaries", "image": edges_image or encode_image_base64(edges)},
                 {"label": "Contours", "description": "Traced outlines of detected shapes", "image": encode_image_base64(contour_vis)},
                 {"label": "Corner Points", "description": "Detected corners where radius is measured", "image": encode_image_base64(corner_vis)},
             ],
@@ -1294,51 +1637,55 @@ def extract_border_radius_with_debug(img):
     }
 
 
-def extract_grid_with_debug(img):
+def extract_grid_with_debug(img, gray=None, edges=None, edges_image=None):
     """
     Extract grid with projection profile visualizations.
+    edges_image is an already-encoded copy of edges, if the caller has one.
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150)
     
-    h_proj = np.sum(edges, axis=0)
-    v_proj = np.sum(edges, axis=1)
+    # Exact integer column/row sums, as in extract_grid
+    h_proj = cv2.reduce(edges, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    v_proj = cv2.reduce(edges, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
     
-    h_proj_vis = np.ones((100, len(h_proj), 3), dtype=np.uint8) * 40
-    v_proj_vis = np.ones((len(v_proj), 100, 3), dtype=np.uint8) * 40
+    h_proj_vis = np.full((100, len(h_proj), 3), 40, dtype=np.uint8)
+    v_proj_vis = np.full((len(v_proj), 100, 3), 40, dtype=np.uint8)
     
     if h_proj.max() > 0:
         h_norm = (h_proj / h_proj.max() * 90).astype(int)
-        for x, val in enumerate(h_norm):
-            cv2.line(h_proj_vis, (x, 99), (x, 99 - val), (100, 180, 255), 1)
+        x = np.arange(len(h_norm))
+        _draw_bars(h_proj_vis, np.column_stack([x, np.full_like(x, 99)]),
+                   np.column_stack([x, 99 - h_norm]), (100, 180, 255))
     
     if v_proj.max() > 0:
         v_norm = (v_proj / v_proj.max() * 90).astype(int)
-        for y, val in enumerate(v_norm):
-            cv2.line(v_proj_vis, (0, y), (val, y), (255, 180, 100), 1)
+        y = np.arange(len(v_norm))
+        _draw_bars(v_proj_vis, np.column_stack([np.zeros_like(y), y]),
+                   np.column_stack([v_norm, y]), (255, 180, 100))
     
     h_proj_vis = cv2.resize(h_proj_vis, (256, 100))
     v_proj_vis = cv2.resize(v_proj_vis, (100, 256))
     v_proj_vis = cv2.rotate(v_proj_vis, cv2.ROTATE_90_COUNTERCLOCKWISE)
     
-    h_peaks = []
+    # Strict local maxima above mean + std, found in one pass
     threshold = np.mean(h_proj) + np.std(h_proj)
-    for i in range(1, len(h_proj) - 1):
-        if h_proj[i] > threshold and h_proj[i] > h_proj[i-1] and h_proj[i] > h_proj[i+1]:
-            h_peaks.append(i)
-    
-    h_gaps = [h_peaks[i+1] - h_peaks[i] for i in range(len(h_peaks)-1)] if len(h_peaks) > 1 else []
+    mid = h_proj[1:-1]
+    h_peaks = np.flatnonzero((mid > threshold) & (mid > h_proj[:-2]) & (mid > h_proj[2:])) + 1
+    h_gaps = np.diff(h_peaks)
     
     result = {
         "columns": 12 if len(h_peaks) >= 12 else max(1, len(h_peaks)),
-        "gutter": int(np.median(h_gaps)) if h_gaps else 16
+        "gutter": int(np.median(h_gaps)) if h_gaps.size else 16
     }
     
     return {
         "tokens": result,
         "debug": {
             "visuals": [
-                {"label": "Edge Map", "description": "Edges used for grid detection", "image": encode_image_base64(edges)},
+                {"label": "Edge Map", "description": "Edges used for grid detection", "image": edges_image or encode_image_base64(edges)},
                 {"label": "Horizontal Projection", "description": "Vertical lines create peaks here - columns", "image": encode_image_base64(h_proj_vis)},
                 {"label": "Vertical Projection", "description": "Horizontal lines create peaks here - rows", "image": encode_image_base64(v_proj_vis)},
             ],
@@ -1354,7 +1701,7 @@ def extract_grid_with_debug(img):
     }
 
 
-def extract_shadows_with_debug(img):
+def extract_shadows_with_debug(img, gray=None):
     """
     Extract shadow/elevation with enhanced multi-cue depth estimation.
     
@@ -1366,15 +1713,18 @@ def extract_shadows_with_debug(img):
     Returns tokens plus comprehensive debug visualizations.
     """
     lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    l_channel = lab[:, :, 0].astype(np.float32)
+    l8 = lab[:, :, 0]
     h, w = img.shape[:2]
     
-    depth_map, depth_debug = heuristic_depth(img)
+    depth_map, depth_debug = heuristic_depth(img, gray=gray)
     
-    grad_x = cv2.Sobel(l_channel, cv2.CV_32F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(l_channel, cv2.CV_32F, 0, 1, ksize=3)
+    # Both 3x3 Sobel derivatives from one pass over the 8-bit L plane; the
+    # int16 responses are exact, so the float32 copies match CV_32F Sobel
+    dx, dy = cv2.spatialGradient(l8)
+    grad_x = dx.astype(np.float32)
+    grad_y = dy.astype(np.float32)
     
-    laplacian = cv2.Laplacian(l_channel, cv2.CV_32F)
+    laplacian = cv2.Laplacian(l8, cv2.CV_16S)
     strength = float(np.mean(np.abs(laplacian)))
     
     avg_depth = float(np.mean(depth_map))
@@ -1389,7 +1739,7 @@ def extract_shadows_with_debug(img):
     else:
         level = 3
     
-    magnitude = np.sqrt(grad_x**2 + grad_y**2)
+    magnitude = cv2.magnitude(grad_x, grad_y)
     threshold = np.percentile(magnitude, 90)
     strong_grads = magnitude > threshold
     
@@ -1398,27 +1748,12 @@ def extract_shadows_with_debug(img):
         avg_grad_y = float(np.mean(grad_y[strong_grads]))
         angle = float(np.degrees(np.arctan2(avg_grad_y, avg_grad_x)))
         
-        if -22.5 <= angle < 22.5:
-            direction = "right"
-        elif 22.5 <= angle < 67.5:
-            direction = "bottom-right"
-        elif 67.5 <= angle < 112.5:
-            direction = "bottom"
-        elif 112.5 <= angle < 157.5:
-            direction = "bottom-left"
-        elif angle >= 157.5 or angle < -157.5:
-            direction = "left"
-        elif -157.5 <= angle < -112.5:
-            direction = "top-left"
-        elif -112.5 <= angle < -67.5:
-            direction = "top"
-        else:
-            direction = "top-right"
+        direction = _shadow_direction(angle)
     else:
         direction = "ambient"
         angle = 0.0
     
-    mag_norm = cv2.normalize(magnitude, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    mag_norm = cv2.normalize(magnitude, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
     mag_color = cv2.applyColorMap(mag_norm, cv2.COLORMAP_INFERNO)
     
     arrow_vis = img.copy()
@@ -1429,28 +1764,32 @@ def extract_shadows_with_debug(img):
     end_y = int(center[1] + arrow_len * np.sin(rad_angle))
     cv2.arrowedLine(arrow_vis, center, (end_x, end_y), (255, 255, 0), 3, tipLength=0.3)
     
-    edges = cv2.Canny(l_channel.astype(np.uint8), 50, 150)
+    edges = cv2.Canny(l8, 50, 150)
     dist_transform = cv2.distanceTransform(255 - edges, cv2.DIST_L2, 5)
-    blur_samples = dist_transform[dist_transform > 0]
-    if len(blur_samples) > 0:
-        blur_radius = float(round(np.median(blur_samples), 1))
+    n_edges = cv2.countNonZero(edges)
+    if n_edges < edges.size:
+        blur_radius = float(round(_median_nonzero(dist_transform, n_edges), 1))
     else:
         blur_radius = 0.0
     blur_radius = min(blur_radius, 24.0)
     
-    hist = cv2.calcHist([l_channel.astype(np.uint8)], [0], None, [256], [0, 256])
+    hist = cv2.calcHist([l8], [0], None, [256], [0, 256])
     hist = hist.flatten() / hist.sum()
     
     dark_ratio = float(np.sum(hist[:85]))
     mid_ratio = float(np.sum(hist[85:170]))
     light_ratio = float(np.sum(hist[170:]))
     
-    hist_vis = np.ones((100, 256, 3), dtype=np.uint8) * 40
+    hist_vis = np.full((100, 256, 3), 40, dtype=np.uint8)
     hist_norm = (hist / hist.max() * 90).astype(int)
-    for x, val in enumerate(hist_norm):
-        cv2.line(hist_vis, (x, 99), (x, 99 - val), (200, 200, 200), 1)
+    x = np.arange(len(hist_norm))
+    _draw_bars(hist_vis, np.column_stack([x, np.full_like(x, 99)]),
+               np.column_stack([x, 99 - hist_norm]), (200, 200, 200))
     
-    contrast = float(np.std(l_channel))
+    # Contrast is the std of L, read off the histogram already built
+    levels = np.arange(256)
+    mean_l = np.dot(levels, hist)
+    contrast = float(np.sqrt(np.dot((levels - mean_l) ** 2, hist)))
     
     if dark_ratio > 0.4 and light_ratio > 0.2:
         depth_style = "high-contrast"
@@ -1463,30 +1802,18 @@ def extract_shadows_with_debug(img):
     else:
         depth_style = "balanced"
     
-    dark_mask = l_channel < 50
-    if np.sum(dark_mask) > 100:
-        dark_pixels = img[dark_mask]
-        if len(dark_pixels) > 0:
-            avg_dark = np.mean(dark_pixels, axis=0)
-            shadow_color = Color(f"rgb({int(avg_dark[2])},{int(avg_dark[1])},{int(avg_dark[0])})").convert("oklch")
-            shadow_hue = shadow_color['h']
-            if shadow_hue is None or np.isnan(shadow_hue):
-                shadow_hue = 0
-            shadow_color_data = {
-                "space": "oklch",
-                "l": round(float(shadow_color['l']), 3),
-                "c": round(float(shadow_color['c']), 3),
-                "h": round(float(shadow_hue), 1)
-            }
-        else:
-            shadow_color_data = None
+    dark_mask = (l8 < 50).view(np.uint8)
+    if cv2.countNonZero(dark_mask) > 100:
+        avg_dark = np.array(cv2.mean(img, mask=dark_mask)[:3])
+        shadow_lch = _oklab_to_oklch(_bgr_to_oklab(avg_dark.astype(np.int32)))[0]
+        shadow_color_data = _oklch_token(*shadow_lch)
     else:
         shadow_color_data = None
     
     depth_vis = create_depth_visualization(depth_map)
-    sharpness_vis = cv2.applyColorMap((depth_debug["sharpness"] * 255).astype(np.uint8), cv2.COLORMAP_HOT)
-    shadow_cue_vis = cv2.applyColorMap((depth_debug["shadow"] * 255).astype(np.uint8), cv2.COLORMAP_BONE)
-    perspective_vis = cv2.applyColorMap((depth_debug["perspective"] * 255).astype(np.uint8), cv2.COLORMAP_COOL)
+    sharpness_vis = create_depth_visualization(depth_debug["sharpness"], cv2.COLORMAP_HOT)
+    shadow_cue_vis = create_depth_visualization(depth_debug["shadow"], cv2.COLORMAP_BONE)
+    perspective_vis = _perspective_visualization(h, w)
     edge_vis = cv2.cvtColor(depth_debug["edges"], cv2.COLOR_GRAY2BGR)
     
     result = {
@@ -1537,37 +1864,29 @@ def extract_shadows_with_debug(img):
     }
 
 
-def extract_strokes_with_debug(img):
+def extract_strokes_with_debug(img, gray=None, edges=None):
     """
     Extract stroke widths with skeleton and distance transform visualizations.
     """
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_OTSU)
     binary_inv = 255 - binary
     
     dist = cv2.distanceTransform(binary_inv, cv2.DIST_L2, 5)
-    dist_norm = cv2.normalize(dist, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    dist_norm = cv2.normalize(dist, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
     dist_color = cv2.applyColorMap(dist_norm, cv2.COLORMAP_JET)
     
-    kernel = np.ones((3, 3), np.uint8)
-    eroded = cv2.erode(binary_inv, kernel, iterations=1)
-    skeleton = cv2.subtract(binary_inv, eroded)
-    
-    skeleton_vis = cv2.cvtColor(skeleton, cv2.COLOR_GRAY2BGR)
-    skeleton_vis[skeleton > 0] = [0, 255, 255]
+    skeleton = _ridge_mask(dist)
     
     overlay = img.copy()
-    overlay[skeleton > 0] = [0, 255, 255]
+    overlay[skeleton] = [0, 255, 255]
     
-    widths = dist[skeleton > 0]
-    
-    if len(widths) == 0 or np.max(widths) < 0.5:
-        edges = cv2.Canny(gray, 50, 150)
-        dilated = cv2.dilate(edges, kernel, iterations=2)
-        dist_from_edges = cv2.distanceTransform(dilated, cv2.DIST_L2, 5)
-        widths = dist_from_edges[dist_from_edges > 0]
+    widths = dist[skeleton]
+    if widths.size == 0:
+        widths = _edge_widths(gray, edges)
     
-    full_widths = [w * 2 for w in widths.tolist()[:200]] if len(widths) > 0 else [1]
+    full_widths = _sample_widths(widths) if widths.size > 0 else [1]
     
     snap = [1, 2, 3, 4, 6, 8]
     result = quantize_values(full_widths, snap)
@@ -1583,7 +1902,7 @@ def extract_strokes_with_debug(img):
             "steps": [
                 "Otsu thresholding separates foreground from background",
                 "Distance transform measures how far each pixel is from an edge",
-                "Skeleton extraction finds the center line of shapes",
+                "Local maxima of the distance transform trace the center line of shapes",
                 "Stroke width = 2 × distance at skeleton points",
                 "We sample stroke widths across the image",
                 "Common widths are snapped to design system values"
@@ -1592,69 +1911,68 @@ def extract_strokes_with_debug(img):
     }
 
 
-def _run_extractor_with_debug(extractor_name, img_bytes, img_shape):
-    """
-    Worker function for parallel extraction with debug info.
-    """
-    img = np.frombuffer(img_bytes, dtype=np.uint8).reshape(img_shape)
-    
-    extractors = {
-        "color": extract_colors_with_debug,
-        "spacing": extract_spacing_with_debug,
-        "borderRadius": extract_border_radius_with_debug,
-        "grid": extract_grid_with_debug,
-        "elevation": extract_shadows_with_debug,
-        "strokeWidth": extract_strokes_with_debug,
-    }
-    
-    extractor_fn = extractors[extractor_name]
-    return extractor_name, extractor_fn(img)
-
-
-def extract_design_tokens_with_walkthrough(img):
+def extract_design_tokens_with_walkthrough(img, visual_payload=True):
     """
     Full extraction with debug visualizations and explanations.
-    Uses parallel processing for speed.
-    """
-    img_resized = resize_for_speed(img, 512)
-    img_bytes = img_resized.tobytes()
-    img_shape = img_resized.shape
-    
-    extractor_names = ["color", "spacing", "borderRadius", "grid", "elevation", "strokeWidth"]
+    Runs the extractors on the shared thread pool; each one only reads the
+    resized image, so they share it without copies or locking.
+    With visual_payload=False the base64 images are dropped from the
+    result, keeping labels, descriptions and steps.
+    """
+    # Read-only view, so the caller's array (returned as-is when it is
+    # already small) keeps its own flags
+    img_resized = resize_for_speed(img, 512).view()
+    img_resized.flags.writeable = False
+    
+    # Grayscale feeds five of the six extractors and the 50/150 Canny map
+    # four of them; build both once and share them read-only
+    gray = cv2.cvtColor(img_resized, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    gray.flags.writeable = False
+    edges.flags.writeable = False
+    # Three extractors show the same edge map; encode it once
+    edges_image = encode_image_base64(edges)
+    
+    jobs = {
+        "color": partial(extract_colors_with_debug, img_resized),
+        "spacing": partial(extract_spacing_with_debug, img_resized, gray=gray, edges=edges, edges_image=edges_image),
+        "borderRadius": partial(extract_border_radius_with_debug, img_resized, gray=gray, edges=edges, edges_image=edges_image),
+        "grid": partial(extract_grid_with_debug, img_resized, gray=gray, edges=edges, edges_image=edges_image),
+        "elevation": partial(extract_shadows_with_debug, img_resized, gray=gray),
+        "strokeWidth": partial(extract_strokes_with_debug, img_resized, gray=gray, edges=edges),
+    }
     
     tokens = {}
     debug = {}
     color_analysis = None
     
+    def collect(name, result):
+        nonlocal color_analysis
+        tokens[name] = result["tokens"]
+        debug[name] = result["debug"]
+        if name == "color" and "analysis" in result:
+            color_analysis = result["analysis"]
+    
     try:
-        with ProcessPoolExecutor(max_workers=len(extractor_names)) as executor:
-            futures = {
-                executor.submit(_run_extractor_with_debug, name, img_bytes, img_shape): name
-                for name in extractor_names
-            }
-            
-            for future in as_completed(futures):
-                name, result = future.result()
-                tokens[name] = result["tokens"]
-                debug[name] = result["debug"]
-                if name == "color" and "analysis" in result:
-                    color_analysis = result["analysis"]
-    except Exception as e:
-        for name in extractor_names:
-            img_copy = np.frombuffer(img_bytes, dtype=np.uint8).reshape(img_shape)
-            extractor = {
-                "color": extract_colors_with_debug,
-                "spacing": extract_spacing_with_debug,
-                "borderRadius": extract_border_radius_with_debug,
-                "grid": extract_grid_with_debug,
-                "elevation": extract_shadows_with_debug,
-                "strokeWidth": extract_strokes_with_debug,
-            }[name]
-            result = extractor(img_copy)
-            tokens[name] = result["tokens"]
-            debug[name] = result["debug"]
-            if name == "color" and "analysis" in result:
-                color_analysis = result["analysis"]
+        executor = _get_thread_pool()
+        futures = {executor.submit(fn): name for name, fn in jobs.items()}
+    except Exception:
+        futures = {}
+    for future in as_completed(futures):
+        try:
+            collect(futures[future], future.result())
+        except Exception:
+            pass
+    
+    # Rerun in-line only the extractors the pool did not deliver
+    for name, fn in jobs.items():
+        if name not in tokens:
+            collect(name, fn())
+    
+    if not visual_payload:
+        for entry in debug.values():
+            for visual in entry["visuals"]:
+                visual["image"] = None
     
     tokens["colorAnalysis"] = color_analysis
     tokens["meta"] = {
@@ -1668,16 +1986,53 @@ def extract_design_tokens_with_walkthrough(img):
     return {"tokens": tokens, "debug": debug}
 
 
-def load_image_from_base64(data_url):
+def _jpeg_size(data):
+    """
+    (width, height) from a JPEG's SOF header, or None for anything else.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (int.from_bytes(data[i + 7:i + 9], "big"),
+                    int.from_bytes(data[i + 5:i + 7], "big"))
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def load_image_from_base64(data_url, max_width=None):
     """
     Load image from base64 data URL.
+    If the caller will downscale to max_width anyway, large JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale inside libjpeg, keeping at least
+    4x max_width on the short side (EXIF rotation may swap the axes) so
+    the final INTER_AREA resize still does the real downsampling.
     """
     if "," in data_url:
         data_url = data_url.split(",", 1)[1]
     
-    img_data = base64.b64decode(data_url)
+    # OpenCV wheels already decode JPEG through libjpeg-turbo; the base64
+    # step is the part worth accelerating when pybase64 is installed
+    img_data = _b64.b64decode(data_url)
     nparr = np.frombuffer(img_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    flag = cv2.IMREAD_COLOR
+    size = _jpeg_size(img_data) if max_width else None
+    if size:
+        short = min(size)
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if short >= factor * 4 * max_width:
+                flag = reduced
+                break
+    img = cv2.imdecode(nparr, flag)
     return img
 
 
@@ -1700,6 +2055,53 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def _dumps(obj):
+    """
+    Serialize a result to UTF-8 JSON bytes. Uses orjson when installed
+    (numpy scalars and arrays natively), else json with NumpyEncoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=NumpyEncoder().default,
+                            option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, cls=NumpyEncoder).encode("utf-8")
+
+
+def serve():
+    """
+    Persistent worker loop: one JSON request per stdin line, one JSON
+    response per stdout line, so imports are paid once per process.
+
+    Request:  {"id": ..., "data": "<base64 or data URL>" | "path": "...",
+               "visuals": false}
+    Response: {"id": ..., "result": {...}} or {"id": ..., "error": "..."}
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if "data" in request:
+                img = load_image_from_base64(request["data"], max_width=512)
+            else:
+                img = load_image_from_file(request["path"])
+            if img is None:
+                raise ValueError("Failed to load image")
+            
+            if request.get("visuals"):
+                result = extract_design_tokens_with_walkthrough(img)
+            else:
+                result = extract_design_tokens(img)
+            response = {"id": request_id, "result": result}
+        except Exception as e:
+            response = {"id": request_id, "error": str(e)}
+        
+        sys.stdout.buffer.write(_dumps(response) + b"\n")
+        sys.stdout.buffer.flush()
+
+
 def main():
     """
     CLI entry point.
@@ -1709,8 +2111,15 @@ def main():
     
     Flags:
     - --with-visuals: Include debug visualizations and step explanations
+    - --no-visual-payload: With --with-visuals, omit the base64 images
+    - --server: Stay resident and serve newline-delimited JSON requests
     """
+    if "--server" in sys.argv:
+        serve()
+        return
+    
     with_visuals = "--with-visuals" in sys.argv
+    visual_payload = "--no-visual-payload" not in sys.argv
     args = [a for a in sys.argv[1:] if not a.startswith("--")]
     
     if len(args) > 0:
@@ -1718,7 +2127,7 @@ def main():
         img = load_image_from_file(file_path)
     else:
         data = sys.stdin.read()
-        img = load_image_from_base64(data)
+        img = load_image_from_base64(data, max_width=512)
 
     if img is None:
         print(json.dumps({"error": "Failed to load image"}), file=sys.stderr)
@@ -1726,11 +2135,11 @@ def main():
 
     try:
         if with_visuals:
-            result = extract_design_tokens_with_walkthrough(img)
-            print(json.dumps(result, cls=NumpyEncoder))
+            result = extract_design_tokens_with_walkthrough(img, visual_payload=visual_payload)
         else:
-            tokens = extract_design_tokens(img)
-            print(json.dumps(tokens, cls=NumpyEncoder))
+            result = extract_design_tokens(img)
+        sys.stdout.buffer.write(_dumps(result) + b"\n")
+        sys.stdout.buffer.flush()
     except Exception as e:
         print(json.dumps({"error": str(e)}), file=sys.stderr)
         sys.exit(1)